@@ -0,0 +1,367 @@
+"""Columnar, date-partitioned archive of attendance records.
+
+``database/attendance.csv`` stays the append-only log written by the
+recognition loop. This module copies rows appended since the last sync into
+one Parquet file per date and keeps per-student daily and monthly rollups up
+to date, so reports and the absentee checker read only the partitions and
+aggregates they need instead of scanning the whole CSV.
+
+Usage:
+    python archive.py sync
+    python archive.py report [--month YYYY-MM] [--compare]
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# ==============================
+# CONFIGURATION
+# ==============================
+
+DATABASE_DIR = "database"
+ATTENDANCE_FILE = os.path.join(DATABASE_DIR, "attendance.csv")
+ARCHIVE_DIR = os.path.join(DATABASE_DIR, "archive")
+PARTITIONS_DIR = os.path.join(ARCHIVE_DIR, "attendance")
+DAILY_ROLLUP_DIR = os.path.join(ARCHIVE_DIR, "daily_rollup")
+MONTHLY_ROLLUP_DIR = os.path.join(ARCHIVE_DIR, "monthly_rollup")
+STATE_FILE = os.path.join(ARCHIVE_DIR, "state.json")
+# Bump when the on-disk layout changes so existing archives are rebuilt.
+ARCHIVE_LAYOUT = 2
+
+REQUIRED_ATTENDANCE_COLUMNS = {"id", "name", "class", "section", "date", "time", "slot_start", "status"}
+CATEGORY_COLUMNS = ["id", "name", "class", "section", "slot_start"]
+COUNT_COLUMNS = ["present", "late", "absent", "slots"]
+
+STATUS_CODES = {"present": 0, "late": 1, "absent": 2}
+UNKNOWN_STATUS = -1
+
+
+def archive_available() -> bool:
+    """Parquet support needs pyarrow; without it callers fall back to the CSV."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def partition_path(date_str: str) -> str:
+    return os.path.join(PARTITIONS_DIR, f"date={date_str}", "part.parquet")
+
+
+def daily_rollup_path(month: str) -> str:
+    return os.path.join(DAILY_ROLLUP_DIR, f"month={month}.parquet")
+
+
+def monthly_rollup_path(month: str) -> str:
+    return os.path.join(MONTHLY_ROLLUP_DIR, f"month={month}.parquet")
+
+
+def _load_state() -> dict:
+    if not os.path.exists(STATE_FILE):
+        return {}
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state: dict) -> None:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = f"{STATE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def _write_parquet(df: pd.DataFrame, path: str) -> None:
+    """Write atomically so a crash never leaves a half-written partition behind."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _read_parquet(path: str, **kwargs) -> pd.DataFrame | None:
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path, **kwargs)
+
+
+def _reset_archive() -> None:
+    shutil.rmtree(ARCHIVE_DIR, ignore_errors=True)
+
+
+def _read_new_rows(header: bytes, offset: int) -> tuple[pd.DataFrame, int]:
+    """Parse complete lines appended after ``offset`` and return the new offset."""
+    start = max(offset, len(header))
+    with open(ATTENDANCE_FILE, "rb") as f:
+        f.seek(start)
+        chunk = f.read()
+
+    # A writer may be mid-line; leave the partial tail for the next sync.
+    end = chunk.rfind(b"\n") + 1
+    columns = pd.read_csv(io.BytesIO(header), nrows=0).columns
+    if end == 0:
+        return pd.DataFrame(columns=columns), start
+
+    rows = pd.read_csv(io.BytesIO(chunk[:end]), names=columns, header=None, dtype=str)
+    return rows, start + end
+
+
+def _encode(rows: pd.DataFrame) -> pd.DataFrame:
+    """Integer-encode statuses and drop rows whose date cannot name a partition."""
+    valid_date = rows["date"].astype(str).str.fullmatch(r"\d{4}-\d{2}-\d{2}")
+    if not valid_date.all():
+        print(f"⚠️ Skipping {int((~valid_date).sum())} attendance row(s) with an invalid date")
+        rows = rows[valid_date]
+
+    encoded = rows[["id", "name", "class", "section", "date", "time", "slot_start"]].astype(str)
+    encoded["status"] = (
+        rows["status"].astype(str).str.strip().str.lower()
+        .map(STATUS_CODES)
+        .fillna(UNKNOWN_STATUS)
+        .astype("int8")
+    )
+    return encoded
+
+
+def _store_partition(records: pd.DataFrame, date_str: str) -> None:
+    records = records.astype({column: "category" for column in CATEGORY_COLUMNS})
+    _write_parquet(records, partition_path(date_str))
+
+
+def read_partition(date_str: str, columns: list[str] | None = None) -> pd.DataFrame | None:
+    """Return one day's attendance records, or None if nothing was archived for it."""
+    return _read_parquet(partition_path(date_str), columns=columns)
+
+
+def _daily_rollup(records: pd.DataFrame, date_str: str) -> pd.DataFrame:
+    ids = records["id"].astype(str)
+    flags = pd.DataFrame({
+        "id": ids,
+        "present": (records["status"] == STATUS_CODES["present"]).astype("int32"),
+        "late": (records["status"] == STATUS_CODES["late"]).astype("int32"),
+        "absent": (records["status"] == STATUS_CODES["absent"]).astype("int32"),
+        "slots": 1,
+    })
+    counts = flags.groupby("id").sum()
+    details = records[["name", "class", "section"]].astype(str).groupby(ids).last()
+
+    rollup = details.join(counts).reset_index()
+    rollup.insert(0, "date", date_str)
+    return rollup
+
+
+def _monthly_rollup(daily: pd.DataFrame, month: str) -> pd.DataFrame:
+    daily = daily.sort_values("date")
+    counts = daily.groupby("id")[COUNT_COLUMNS].sum()
+    details = daily.groupby("id")[["name", "class", "section"]].last()
+
+    rollup = details.join(counts).reset_index()
+    rollup.insert(0, "month", month)
+    return rollup
+
+
+def _replace_rows(path: str, key_column: str, keys: list[str], new_rows: pd.DataFrame) -> None:
+    existing = _read_parquet(path)
+    if existing is not None:
+        existing = existing[~existing[key_column].isin(keys)]
+        new_rows = pd.concat([existing, new_rows], ignore_index=True)
+    new_rows = new_rows.sort_values([key_column, "id"], ignore_index=True)
+    _write_parquet(new_rows, path)
+
+
+def _ingest(rows: pd.DataFrame) -> int:
+    """Merge new rows into their date partitions and refresh the affected rollups."""
+    encoded = _encode(rows)
+    if encoded.empty:
+        return 0
+
+    daily_frames = []
+    for date_str, day_rows in encoded.groupby("date", sort=True):
+        day_rows = day_rows.drop(columns="date")
+        existing = read_partition(date_str)
+        if existing is not None:
+            existing = existing.astype({column: str for column in CATEGORY_COLUMNS})
+            day_rows = pd.concat([existing, day_rows], ignore_index=True)
+
+        # Same rule as the recognition loop: one record per student per slot.
+        day_rows = day_rows.drop_duplicates(subset=["id", "slot_start"], keep="first")
+        _store_partition(day_rows, date_str)
+        daily_frames.append(_daily_rollup(day_rows, date_str))
+
+    # Rollups are stored one file per month, so a sync only rewrites the months it touched.
+    daily_by_month = {}
+    for frame in daily_frames:
+        daily_by_month.setdefault(frame["date"].iat[0][:7], []).append(frame)
+
+    for month, frames in sorted(daily_by_month.items()):
+        dates = [frame["date"].iat[0] for frame in frames]
+        path = daily_rollup_path(month)
+        _replace_rows(path, "date", dates, pd.concat(frames, ignore_index=True))
+        _write_parquet(_monthly_rollup(_read_parquet(path), month), monthly_rollup_path(month))
+
+    return len(encoded)
+
+
+def sync() -> bool:
+    """Archive rows appended to attendance.csv since the last sync.
+
+    Only the bytes after the stored offset are parsed. If the CSV was
+    truncated or its header changed, the archive is rebuilt from scratch.
+    Returns False when the archive cannot be used.
+    """
+    if not archive_available():
+        print("⚠️ pyarrow is not installed; attendance archive disabled.")
+        return False
+    if not os.path.exists(ATTENDANCE_FILE):
+        return True
+
+    with open(ATTENDANCE_FILE, "rb") as f:
+        header = f.readline()
+    if not header.endswith(b"\n"):
+        return True
+
+    state = _load_state()
+    header_text = header.decode("utf-8")
+    if state and state.get("layout") != ARCHIVE_LAYOUT:
+        print("⚠️ Attendance archive layout changed; rebuilding archive.")
+        state = {}
+    elif state.get("csv_header") != header_text or os.path.getsize(ATTENDANCE_FILE) < state.get("csv_offset", 0):
+        if state:
+            print("⚠️ attendance.csv was rewritten; rebuilding archive.")
+        state = {}
+
+    if not state:
+        _reset_archive()
+        state = {"layout": ARCHIVE_LAYOUT, "csv_header": header_text, "csv_offset": 0}
+
+    try:
+        rows, offset = _read_new_rows(header, state["csv_offset"])
+    except Exception as exc:
+        print(f"❌ Failed to read '{ATTENDANCE_FILE}': {exc}")
+        return False
+
+    missing = sorted(REQUIRED_ATTENDANCE_COLUMNS - set(rows.columns))
+    if missing:
+        print(f"❌ {ATTENDANCE_FILE} is missing columns: {', '.join(missing)}")
+        return False
+
+    if not rows.empty:
+        try:
+            _ingest(rows)
+        except Exception as exc:
+            print(f"❌ Failed to update attendance archive: {exc}")
+            return False
+
+    state["csv_offset"] = offset
+    _save_state(state)
+    return True
+
+
+def present_ids_for(date_str: str) -> set[str]:
+    """Student IDs with any attendance record on ``date_str``, read from one partition."""
+    records = read_partition(date_str, columns=["id"])
+    if records is None:
+        return set()
+    return set(records["id"].astype(str).tolist())
+
+
+def _with_percentages(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    attended = df["present"] + df["late"]
+    df["attendance_pct"] = (attended / df["slots"].where(df["slots"] > 0) * 100).fillna(0.0).round(1)
+    return df
+
+
+def monthly_report(month: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-student and per-class attendance for ``month`` (YYYY-MM) from the rollups."""
+    monthly = _read_parquet(monthly_rollup_path(month))
+    if monthly is None:
+        monthly = pd.DataFrame(columns=["month", "id", "name", "class", "section", *COUNT_COLUMNS])
+    return _student_and_class_summaries(monthly)
+
+
+def monthly_report_from_csv(month: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """The same report computed with a full scan of attendance.csv, for comparison."""
+    df = pd.read_csv(ATTENDANCE_FILE, dtype=str)
+    df = df[df["date"].str.startswith(month, na=False)]
+    df = df.drop_duplicates(subset=["id", "date", "slot_start"], keep="first")
+
+    status = df["status"].str.strip().str.lower()
+    df = df.assign(
+        present=(status == "present").astype("int32"),
+        late=(status == "late").astype("int32"),
+        absent=(status == "absent").astype("int32"),
+        slots=1,
+    ).sort_values("date")
+
+    counts = df.groupby("id")[COUNT_COLUMNS].sum()
+    details = df.groupby("id")[["name", "class", "section"]].last()
+    monthly = details.join(counts).reset_index()
+    return _student_and_class_summaries(monthly)
+
+
+def _student_and_class_summaries(monthly: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    students = _with_percentages(monthly[["id", "name", "class", "section", *COUNT_COLUMNS]])
+    students = students.sort_values(["class", "section", "id"], ignore_index=True)
+
+    classes = monthly.groupby(["class", "section"])[COUNT_COLUMNS].sum()
+    classes["students"] = monthly.groupby(["class", "section"])["id"].nunique()
+    classes = _with_percentages(classes.reset_index())
+    return students, classes
+
+
+def report(month: str, compare: bool) -> None:
+    if not sync():
+        return
+
+    started = time.perf_counter()
+    students, classes = monthly_report(month)
+    rollup_seconds = time.perf_counter() - started
+
+    print(f"Attendance report for {month}\n")
+    if students.empty:
+        print("No attendance recorded for this month.")
+    else:
+        print("Per student:")
+        print(students.to_string(index=False))
+        print("\nPer class:")
+        print(classes.to_string(index=False))
+
+    print(f"\nRollup query: {rollup_seconds * 1000:.2f} ms")
+    if compare and os.path.exists(ATTENDANCE_FILE):
+        started = time.perf_counter()
+        monthly_report_from_csv(month)
+        csv_seconds = time.perf_counter() - started
+        print(f"Full CSV scan: {csv_seconds * 1000:.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Attendance archive and reports")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("sync", help="archive rows appended to attendance.csv")
+
+    report_parser = commands.add_parser("report", help="monthly attendance report")
+    report_parser.add_argument("--month", default=datetime.now().strftime("%Y-%m"), help="YYYY-MM")
+    report_parser.add_argument("--compare", action="store_true", help="also time a full CSV scan")
+
+    args = parser.parse_args()
+    if args.command == "sync":
+        if sync():
+            print("✅ Attendance archive is up to date.")
+    else:
+        report(args.month, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@ import pandas as pd
 from twilio.base.exceptions import TwilioException
 from twilio.rest import Client
 
+import archive
+
 # ==============================
 # CONFIGURATION
 # ==============================
@@ -120,6 +122,13 @@ def present_ids_today(attendance_df: pd.DataFrame | None, today_date: str) -> se
     return set(today["id"].astype(str).tolist())
 
 
+def archived_present_ids(today_date: str) -> set[str] | None:
+    """Read today's IDs from the date-partitioned archive; None if it is unavailable."""
+    if not archive.archive_available() or not archive.sync():
+        return None
+    return archive.present_ids_for(today_date)
+
+
 def iter_absentees(students_df: pd.DataFrame, present_ids: set[str]) -> Iterable[pd.Series]:
     """Yield student rows that are absent today."""
     for _, student in students_df.iterrows():
@@ -145,9 +154,12 @@ def check_absentees(client: Client | None) -> None:
     today_date = now.strftime("%Y-%m-%d")
     current_hour = now.strftime("%H")
 
-    attendance_df = read_csv_safe(ATTENDANCE_FILE)
-    if attendance_df is not None and not ensure_columns(attendance_df, REQUIRED_ATTENDANCE_COLUMNS, ATTENDANCE_FILE):
-        return
+    present_ids = archived_present_ids(today_date)
+    if present_ids is None:
+        attendance_df = read_csv_safe(ATTENDANCE_FILE)
+        if attendance_df is not None and not ensure_columns(attendance_df, REQUIRED_ATTENDANCE_COLUMNS, ATTENDANCE_FILE):
+            return
+        present_ids = present_ids_today(attendance_df, today_date)
 
     log_df = read_csv_safe(LOG_FILE)
     if log_df is None:
@@ -155,8 +167,6 @@ def check_absentees(client: Client | None) -> None:
     elif not ensure_columns(log_df, REQUIRED_LOG_COLUMNS, LOG_FILE):
         return
 
-    present_ids = present_ids_today(attendance_df, today_date)
-
     sent_count = 0
     skipped_count = 0
     absent_count = 0
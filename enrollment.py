@@ -0,0 +1,170 @@
+"""ID-keyed enrollment index over students.csv and the embedding gallery.
+
+The roster is held as a dict keyed by student ID, so lookups and upserts are
+O(1) and re-registering a student replaces their row instead of appending a
+duplicate. Before a new embedding is stored it is compared against the whole
+gallery, which catches the same face being enrolled under a different ID.
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# ==============================
+# CONFIGURATION
+# ==============================
+
+DATABASE_DIR = "database"
+STUDENTS_FILE = os.path.join(DATABASE_DIR, "students.csv")
+EMBEDDING_FILE = os.path.join(DATABASE_DIR, "embeddings.pkl")
+IMAGES_DIR = "images"
+
+STUDENT_COLUMNS = ["id", "name", "class", "section", "parent_phone"]
+
+# Cosine similarity at which recognition treats a face as a gallery match.
+MATCH_THRESHOLD = 0.78
+# A face this close to another student's would be identified as them anyway.
+DUPLICATE_FACE_THRESHOLD = float(os.getenv("DUPLICATE_FACE_THRESHOLD", str(MATCH_THRESHOLD)))
+
+
+def load_roster() -> dict[str, dict]:
+    """Read students.csv into a dict keyed by ID; the last row for an ID wins."""
+    if not os.path.exists(STUDENTS_FILE):
+        return {}
+
+    try:
+        students_df = pd.read_csv(STUDENTS_FILE, dtype=str, keep_default_na=False)
+    except Exception as exc:
+        print(f"❌ Could not read students list: {exc}")
+        return {}
+
+    missing = sorted(set(STUDENT_COLUMNS) - set(students_df.columns))
+    if missing:
+        print(f"❌ {STUDENTS_FILE} is missing columns: {', '.join(missing)}")
+        return {}
+
+    students_df = students_df[STUDENT_COLUMNS].drop_duplicates(subset="id", keep="last")
+    records = students_df.to_dict("records")
+    return {record["id"]: record for record in records}
+
+
+def save_roster(roster: dict[str, dict]) -> None:
+    """Rewrite students.csv with one row per ID, replacing the file atomically."""
+    os.makedirs(DATABASE_DIR, exist_ok=True)
+    students_df = pd.DataFrame(list(roster.values()), columns=STUDENT_COLUMNS)
+    tmp_path = f"{STUDENTS_FILE}.tmp"
+    students_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, STUDENTS_FILE)
+
+
+def load_gallery() -> dict[str, dict]:
+    if not os.path.exists(EMBEDDING_FILE):
+        return {}
+    with open(EMBEDDING_FILE, "rb") as f:
+        return pickle.load(f)
+
+
+def save_gallery(gallery: dict[str, dict]) -> None:
+    os.makedirs(DATABASE_DIR, exist_ok=True)
+    tmp_path = f"{EMBEDDING_FILE}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(gallery, f)
+    os.replace(tmp_path, EMBEDDING_FILE)
+
+
+def enrolled_gallery(roster: dict[str, dict], gallery: dict[str, dict]) -> dict[str, dict]:
+    """Gallery entries for students on the roster; stale entries can never be matched."""
+    return {sid: gallery[sid] for sid in roster if sid in gallery}
+
+
+def gallery_matrix(gallery: dict[str, dict]) -> tuple[list[str], np.ndarray]:
+    """Stack gallery embeddings into L2-normalised rows for one-shot cosine scoring."""
+    ids = list(gallery)
+    if not ids:
+        return ids, np.empty((0, 0))
+
+    matrix = np.array([gallery[sid]["embedding"] for sid in ids], dtype=np.float64)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return ids, matrix / np.where(norms == 0, 1, norms)
+
+
+def best_match(ids: list[str], matrix: np.ndarray, embedding) -> tuple[str | None, float]:
+    """Return the gallery ID most similar to ``embedding`` and its cosine similarity."""
+    if not ids:
+        return None, -1
+
+    vector = np.asarray(embedding, dtype=np.float64)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None, -1
+
+    scores = matrix @ (vector / norm)
+    best = int(np.argmax(scores))
+    return ids[best], float(scores[best])
+
+
+def find_duplicate_face(gallery: dict[str, dict], embedding, student_id: str) -> tuple[str | None, float]:
+    """Find another enrolled student whose face matches ``embedding``.
+
+    Pass the ``enrolled_gallery`` so only faces recognition can match are
+    considered. The student's own entry is ignored so re-registering them is
+    allowed.
+    """
+    others = {sid: data for sid, data in gallery.items() if sid != student_id}
+    match_id, score = best_match(*gallery_matrix(others), embedding)
+    if match_id is not None and score >= DUPLICATE_FACE_THRESHOLD:
+        return match_id, score
+    return None, score
+
+
+def image_path_for(student_id: str, name: str) -> str:
+    return os.path.join(IMAGES_DIR, f"{student_id}_{name}.jpg")
+
+
+def staged_image_path(student_id: str, name: str) -> str:
+    """Where a new capture waits until enrollment succeeds, so it never overwrites the enrolled photo."""
+    return os.path.join(IMAGES_DIR, f".pending_{student_id}_{name}.jpg")
+
+
+def upsert_student(student: dict, embedding, staged_image: str | None = None) -> None:
+    """Insert or replace one student in both the roster and the gallery.
+
+    A ``staged_image`` becomes the student's photo, replacing the one this ID
+    was previously enrolled under if the name changed.
+    """
+    gallery = load_gallery()
+    previous_entry = gallery.get(student["id"])
+    gallery[student["id"]] = {
+        "name": student["name"],
+        "class": student["class"],
+        "section": student["section"],
+        "parent_phone": student["parent_phone"],
+        "embedding": embedding,
+    }
+    save_gallery(gallery)
+
+    roster = load_roster()
+    previous = roster.get(student["id"])
+    roster[student["id"]] = {column: student[column] for column in STUDENT_COLUMNS}
+    try:
+        save_roster(roster)
+    except Exception:
+        # Undo the gallery write so the two stores keep describing the same students.
+        if previous_entry is None:
+            del gallery[student["id"]]
+        else:
+            gallery[student["id"]] = previous_entry
+        save_gallery(gallery)
+        raise
+
+    if staged_image is not None:
+        image_path = image_path_for(student["id"], student["name"])
+        os.replace(staged_image, image_path)
+        if previous is not None:
+            old_image = image_path_for(student["id"], previous["name"])
+            if old_image != image_path and os.path.exists(old_image):
+                os.remove(old_image)
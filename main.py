@@ -101,6 +101,8 @@ def start_recognition():
 
 
 def exit_app():
+    # SIGTERM skips atexit handlers, so commit buffered attendance first.
+    recognise.flush_attendance(force=True)
     try:
         root.destroy()
     except:
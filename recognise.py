@@ -1,5 +1,6 @@
+import atexit
 import os
-import pickle
+import threading
 from datetime import datetime, timedelta
 
 import cv2
@@ -8,56 +9,137 @@ import pandas as pd
 from deepface import DeepFace
 
 import automatic
+import enrollment
 
-EMBEDDING_FILE = "database/embeddings.pkl"
+EMBEDDING_FILE = enrollment.EMBEDDING_FILE
 ATTENDANCE_FILE = "database/attendance.csv"
-STUDENTS_FILE = "database/students.csv"
+STUDENTS_FILE = enrollment.STUDENTS_FILE
 
-THRESHOLD = 0.78
+THRESHOLD = enrollment.MATCH_THRESHOLD
 SLOT_MINUTES = 60
 PRESENT_WITHIN_MINUTES = 5
 LATE_WITHIN_MINUTES = 10
 
+# Comma-separated slot start times (HH:MM), e.g. "08:30,09:25,10:20".
+# When empty, a slot starts when recognition begins and repeats every SLOT_MINUTES.
+SLOT_TIMETABLE = os.getenv("SLOT_TIMETABLE", "")
+# Seconds between inferences once every expected student is finalized for the slot.
+IDLE_SAMPLE_SECONDS = float(os.getenv("IDLE_SAMPLE_SECONDS", "5"))
+# Return to full frame rate this many seconds before the next slot starts.
+RAMP_UP_SECONDS = int(os.getenv("RAMP_UP_SECONDS", "60"))
+# Mean pixel difference (0-255) on a downscaled frame that counts as motion while idle.
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "8"))
+# Minimum spacing between motion-triggered inferences while idle.
+MOTION_MIN_SECONDS = float(os.getenv("MOTION_MIN_SECONDS", "1"))
+
+# Attendance rows are buffered and appended to the CSV in group commits by a
+# writer thread, once ATTENDANCE_BATCH_SIZE rows are queued or the oldest queued
+# row is ATTENDANCE_FLUSH_SECONDS old, whichever comes first.
+ATTENDANCE_BATCH_SIZE = int(os.getenv("ATTENDANCE_BATCH_SIZE", "50"))
+# "fsync": flush and fsync every batch; "flush": flush every batch to the OS (default);
+# "best-effort": no explicit flush beyond closing the file, and a longer default interval.
+DURABILITY_MODES = ("fsync", "flush", "best-effort")
+DEFAULT_DURABILITY = "flush"
+DEFAULT_FLUSH_SECONDS = {"fsync": "2", "flush": "2", "best-effort": "30"}
+ATTENDANCE_COLUMNS = ["id", "name", "class", "section", "date", "time", "slot_start", "status"]
+
 
 marked_slots = set()
+pending_attendance = []
+pending_attendance_since = None
+attendance_lock = threading.Lock()
+attendance_ready = threading.Condition(attendance_lock)
+# Serialises group commits so a shutdown flush cannot interleave with the writer thread.
+attendance_write_lock = threading.Lock()
+attendance_writer = None
+
+
+def parse_timetable(spec: str) -> list[tuple[int, int]]:
+    starts = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            parsed = datetime.strptime(part, "%H:%M")
+        except ValueError:
+            print(f"⚠️ Ignoring invalid timetable entry '{part}' (expected HH:MM)")
+            continue
+        starts.add((parsed.hour, parsed.minute))
+    return sorted(starts)
+
+
+TIMETABLE = parse_timetable(SLOT_TIMETABLE)
 
 
-def cosine_similarity(vec1, vec2):
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+def parse_durability(mode: str) -> str:
+    mode = mode.strip().lower()
+    if mode not in DURABILITY_MODES:
+        print(
+            f"⚠️ Unknown ATTENDANCE_DURABILITY '{mode}' "
+            f"(expected one of {', '.join(DURABILITY_MODES)}); using '{DEFAULT_DURABILITY}'"
+        )
+        return DEFAULT_DURABILITY
+    return mode
+
+
+ATTENDANCE_DURABILITY = parse_durability(os.getenv("ATTENDANCE_DURABILITY", DEFAULT_DURABILITY))
+ATTENDANCE_FLUSH_SECONDS = float(
+    os.getenv("ATTENDANCE_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS[ATTENDANCE_DURABILITY])
+)
 
 
 def slot_start_for(now: datetime) -> datetime:
-    return now.replace(second=0, microsecond=0)
+    if not TIMETABLE:
+        return now.replace(second=0, microsecond=0)
+
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    starts = [midnight + timedelta(hours=hour, minutes=minute) for hour, minute in TIMETABLE]
+    started = [start for start in starts if start <= now]
+    if started:
+        return started[-1]
+    return starts[-1] - timedelta(days=1)
+
+
+def next_slot_start(slot_start: datetime) -> datetime:
+    if not TIMETABLE:
+        return slot_start + timedelta(minutes=SLOT_MINUTES)
+
+    midnight = slot_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    for day_offset in (0, 1):
+        for hour, minute in TIMETABLE:
+            start = midnight + timedelta(days=day_offset, hours=hour, minutes=minute)
+            if start > slot_start:
+                return start
+    return slot_start + timedelta(days=1)
+
+
+def inference_interval_seconds(now: datetime, next_start: datetime, slot_tracker) -> float:
+    """Seconds to wait between inferences; 0 means run on every frame.
+
+    Status only depends on faces seen inside the late window, so the camera
+    runs at full rate until every expected student is finalized, samples
+    slowly afterwards, and ramps back up shortly before the next slot.
+    """
+    if now >= next_start - timedelta(seconds=RAMP_UP_SECONDS):
+        return 0.0
+    if all(info["attendance_written"] for info in slot_tracker.values()):
+        return IDLE_SAMPLE_SECONDS
+    return 0.0
+
+
+def detect_motion(frame, reference_gray):
+    """Compare ``frame`` with the frame of the last inference, not the previous frame."""
+    gray = cv2.cvtColor(cv2.resize(frame, (160, 120)), cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    if reference_gray is None:
+        return False, gray
+    score = float(np.mean(cv2.absdiff(gray, reference_gray)))
+    return score >= MOTION_THRESHOLD, gray
 
 
 def load_students() -> dict[str, dict]:
-    if not os.path.exists(STUDENTS_FILE):
-        return {}
-
-    try:
-        students_df = pd.read_csv(STUDENTS_FILE, dtype=str)
-    except Exception as exc:
-        print(f"❌ Could not read students list: {exc}")
-        return {}
-
-    required = {"id", "name", "class", "section", "parent_phone"}
-    if not required.issubset(students_df.columns):
-        print("❌ students.csv is missing required columns.")
-        return {}
-
-    students = {}
-    for _, row in students_df.iterrows():
-        sid = str(row["id"])
-        students[sid] = {
-            "id": sid,
-            "name": str(row["name"]),
-            "class": str(row["class"]),
-            "section": str(row["section"]),
-            "parent_phone": str(row["parent_phone"]),
-        }
-    return students
+    return enrollment.load_roster()
 
 
 def initialize_marked_slots_cache() -> None:
@@ -86,6 +168,8 @@ def status_for_seen_time(first_seen_at: datetime, slot_start: datetime) -> str:
 
 
 def mark_attendance(student: dict, status: str, slot_start: datetime, recorded_at: datetime):
+    global pending_attendance_since
+
     date_str = slot_start.strftime("%Y-%m-%d")
     time_str = recorded_at.strftime("%H:%M:%S")
     slot_start_str = slot_start.strftime("%H:%M")
@@ -94,8 +178,10 @@ def mark_attendance(student: dict, status: str, slot_start: datetime, recorded_a
     if key in marked_slots:
         return
 
-    attendance_data = pd.DataFrame([
-        {
+    with attendance_ready:
+        if not pending_attendance:
+            pending_attendance_since = datetime.now()
+        pending_attendance.append({
             "id": student["id"],
             "name": student["name"],
             "class": student["class"],
@@ -104,27 +190,86 @@ def mark_attendance(student: dict, status: str, slot_start: datetime, recorded_a
             "time": time_str,
             "slot_start": slot_start_str,
             "status": status,
-        }
-    ])
-
-    needs_header = (not os.path.exists(ATTENDANCE_FILE)) or os.path.getsize(ATTENDANCE_FILE) == 0
-    attendance_data.to_csv(
-        ATTENDANCE_FILE,
-        mode="a" if not needs_header else "w",
-        header=needs_header,
-        index=False,
-    )
+        })
+        if _attendance_flush_due():
+            attendance_ready.notify()
+    start_attendance_writer()
 
     marked_slots.add(key)
     print(f"✅ {student['name']} marked {status.upper()} for slot {slot_start_str}")
 
 
-def make_slot_tracker(students: dict[str, dict]):
+def _attendance_flush_due() -> bool:
+    """Whether the queued rows should be committed now; call with attendance_lock held."""
+    if not pending_attendance:
+        return False
+    if len(pending_attendance) >= ATTENDANCE_BATCH_SIZE:
+        return True
+    return (datetime.now() - pending_attendance_since).total_seconds() >= ATTENDANCE_FLUSH_SECONDS
+
+
+def flush_attendance(force: bool = False) -> None:
+    """Append queued attendance rows to the CSV as one group commit.
+
+    Without ``force`` nothing is written until the batch is full or the oldest
+    queued row has waited ATTENDANCE_FLUSH_SECONDS.
+    """
+    global pending_attendance_since
+
+    with attendance_write_lock:
+        with attendance_lock:
+            if not pending_attendance or not (force or _attendance_flush_due()):
+                return
+            rows = list(pending_attendance)
+            queued_since = pending_attendance_since
+            pending_attendance.clear()
+            pending_attendance_since = None
+
+        # The frame loop can keep queueing rows while this batch is written.
+        batch = pd.DataFrame(rows, columns=ATTENDANCE_COLUMNS)
+        needs_header = (not os.path.exists(ATTENDANCE_FILE)) or os.path.getsize(ATTENDANCE_FILE) == 0
+        try:
+            with open(ATTENDANCE_FILE, "a" if not needs_header else "w", newline="") as f:
+                batch.to_csv(f, header=needs_header, index=False)
+                if ATTENDANCE_DURABILITY in ("fsync", "flush"):
+                    f.flush()
+                if ATTENDANCE_DURABILITY == "fsync":
+                    os.fsync(f.fileno())
+        except OSError as exc:
+            # Requeue the rows ahead of newer ones so the next flush retries them.
+            print(f"❌ Could not write attendance: {exc}")
+            with attendance_lock:
+                pending_attendance[:0] = rows
+                pending_attendance_since = queued_since
+
+
+def _run_attendance_writer() -> None:
+    while True:
+        with attendance_ready:
+            # Woken early when a batch fills; otherwise re-check the age rule every second.
+            attendance_ready.wait(timeout=1.0)
+        flush_attendance()
+
+
+def start_attendance_writer() -> None:
+    """Start the background thread that commits queued rows off the frame loop."""
+    global attendance_writer
+
+    if attendance_writer is not None and attendance_writer.is_alive():
+        return
+    attendance_writer = threading.Thread(target=_run_attendance_writer, name="attendance-writer", daemon=True)
+    attendance_writer.start()
+
+
+atexit.register(flush_attendance, force=True)
+
+
+def make_slot_tracker(students: dict[str, dict], closed: bool = False):
     return {
         sid: {
             "student": student,
             "first_seen": None,
-            "attendance_written": False,
+            "attendance_written": closed,
             "sms_sent": False,
         }
         for sid, student in students.items()
@@ -163,32 +308,58 @@ def finalize_slot_if_needed(slot_tracker, current_slot_start, client):
                 info["sms_sent"] = True
 
 
+def identify_face(frame, gallery_ids, gallery):
+    """Return the closest gallery ID and its similarity, or (None, -1) when no face is found."""
+    try:
+        result = DeepFace.represent(
+            img_path=frame,
+            model_name="Facenet",
+            enforce_detection=True,
+        )
+    except Exception:
+        return None, -1
+
+    return enrollment.best_match(gallery_ids, gallery, result[0]["embedding"])
+
+
 def recognize(session_duration_seconds=None):
     if not os.path.exists(EMBEDDING_FILE):
         print("❌ No registered students found.")
         return
 
-    with open(EMBEDDING_FILE, "rb") as f:
-        db = pickle.load(f)
-
     students = load_students()
     if not students:
         print("❌ No students found in database/students.csv.")
         return
 
+    # Only score against enrolled students, once per frame as a single matrix product.
+    gallery_ids, gallery = enrollment.gallery_matrix(
+        enrollment.enrolled_gallery(students, enrollment.load_gallery())
+    )
+
     initialize_marked_slots_cache()
     client = automatic.build_client()
 
     cap = cv2.VideoCapture(0)
     start_time = datetime.now()
 
-    current_slot_start = slot_start_for(datetime.now())
-    slot_tracker = make_slot_tracker(students)
+    current_slot_start = slot_start_for(start_time)
+    upcoming_slot_start = next_slot_start(current_slot_start)
+    # Joining a timetabled slot after its late window would mark everyone absent
+    # without having watched the door, so wait for the next slot instead.
+    joined_late = start_time - current_slot_start > timedelta(minutes=LATE_WITHIN_MINUTES)
+    slot_tracker = make_slot_tracker(students, closed=joined_late)
+    if joined_late:
+        print(f"🕒 Slot {current_slot_start.strftime('%H:%M')} already closed; next slot at {upcoming_slot_start.strftime('%H:%M')}")
+
+    last_inference_at = None
+    reference_gray = None
 
     while True:
         now = datetime.now()
-        if now >= current_slot_start + timedelta(minutes=SLOT_MINUTES):
+        if now >= upcoming_slot_start:
             current_slot_start = slot_start_for(now)
+            upcoming_slot_start = next_slot_start(current_slot_start)
             slot_tracker = make_slot_tracker(students)
             print(f"🕒 New attendance slot started: {current_slot_start.strftime('%H:%M')}")
 
@@ -196,25 +367,25 @@ def recognize(session_duration_seconds=None):
         if not ret:
             break
 
-        try:
-            result = DeepFace.represent(
-                img_path=frame,
-                model_name="Facenet",
-                enforce_detection=True,
+        interval = inference_interval_seconds(now, upcoming_slot_start, slot_tracker)
+        if interval > 0:
+            motion, gray = detect_motion(frame, reference_gray)
+            since_inference = (
+                interval if last_inference_at is None
+                else (now - last_inference_at).total_seconds()
             )
+            run_inference = since_inference >= interval or (
+                motion and since_inference >= MOTION_MIN_SECONDS
+            )
+            if run_inference or reference_gray is None:
+                reference_gray = gray
+        else:
+            reference_gray = None
+            run_inference = True
 
-            captured_embedding = result[0]["embedding"]
-
-            best_match_id = None
-            best_score = -1
-
-            for student_id, data in db.items():
-                stored_embedding = data["embedding"]
-                similarity = cosine_similarity(captured_embedding, stored_embedding)
-
-                if similarity > best_score:
-                    best_score = similarity
-                    best_match_id = student_id
+        if run_inference:
+            last_inference_at = now
+            best_match_id, best_score = identify_face(frame, gallery_ids, gallery)
 
             if best_score >= THRESHOLD and best_match_id in slot_tracker:
                 student = students[best_match_id]
@@ -232,7 +403,7 @@ def recognize(session_duration_seconds=None):
                 if slot_tracker[best_match_id]["first_seen"] is None:
                     slot_tracker[best_match_id]["first_seen"] = now
 
-            else:
+            elif best_match_id is not None:
                 cv2.putText(
                     frame,
                     "Unknown",
@@ -243,9 +414,6 @@ def recognize(session_duration_seconds=None):
                     2,
                 )
 
-        except Exception:
-            pass
-
         finalize_slot_if_needed(slot_tracker, current_slot_start, client)
 
         cv2.imshow("Face Recognition", frame)
@@ -257,9 +425,11 @@ def recognize(session_duration_seconds=None):
             print("⏱️ Recognition session completed.")
             break
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord("q") or key == 27:  # q or ESC
             break
 
+    flush_attendance(force=True)
     cap.release()
     cv2.destroyAllWindows()
 
@@ -1,16 +1,13 @@
 import cv2
 import os
-import pickle
-import pandas as pd
 from deepface import DeepFace
 import sys
 
+import enrollment
+
 os.makedirs("images", exist_ok=True)
 os.makedirs("database", exist_ok=True)
 
-EMBEDDING_FILE = "database/embeddings.pkl"
-STUDENT_FILE = "database/students.csv"
-
 
 def register_student(student_id, name, student_class, section, parent_phone):
     cap = cv2.VideoCapture(0)
@@ -39,8 +36,8 @@ def register_student(student_id, name, student_class, section, parent_phone):
     cap.release()
     cv2.destroyAllWindows()
 
-    # Save Image
-    image_path = f"images/{student_id}_{name}.jpg"
+    # Save Image (staged until enrollment succeeds)
+    image_path = enrollment.staged_image_path(student_id, name)
     cv2.imwrite(image_path, frame)
     print("Image saved.")
 
@@ -56,44 +53,31 @@ def register_student(student_id, name, student_class, section, parent_phone):
         os.remove(image_path)
         return
 
-    # Load existing embeddings
-    if os.path.exists(EMBEDDING_FILE):
-        with open(EMBEDDING_FILE, "rb") as f:
-            db = pickle.load(f)
-    else:
-        db = {}
-
-    # Store embedding + phone
-    db[student_id] = {
-        "name": name,
-        "class": student_class,
-        "section": section,
-        "parent_phone": parent_phone,
-        "embedding": embedding
-    }
+    # Refuse a face that is already enrolled under another ID
+    gallery = enrollment.enrolled_gallery(enrollment.load_roster(), enrollment.load_gallery())
+    duplicate_id, score = enrollment.find_duplicate_face(gallery, embedding, student_id)
+    if duplicate_id is not None:
+        print(f"This face is already registered as ID {duplicate_id} (similarity {score:.2f}).")
+        os.remove(image_path)
+        return
 
-    with open(EMBEDDING_FILE, "wb") as f:
-        pickle.dump(db, f)
+    # Store embedding + roster row, replacing any previous entry for this ID
+    try:
+        enrollment.upsert_student({
+            "id": student_id,
+            "name": name,
+            "class": student_class,
+            "section": section,
+            "parent_phone": parent_phone
+        }, embedding, staged_image=image_path)
+    except OSError as exc:
+        print(f"Could not save registration: {exc}")
+        if os.path.exists(image_path):
+            os.remove(image_path)
+        return
 
     print("Embedding stored.")
 
-    # Save to students.csv
-    student_data = pd.DataFrame([{
-        "id": student_id,
-        "name": name,
-        "class": student_class,
-        "section": section,
-        "parent_phone": parent_phone
-    }])
-
-    needs_header = (not os.path.exists(STUDENT_FILE)) or os.path.getsize(STUDENT_FILE) == 0
-    student_data.to_csv(
-        STUDENT_FILE,
-        mode='a' if not needs_header else 'w',
-        header=needs_header,
-        index=False,
-    )
-
     print("Student Registered Successfully!\n")
 
 